@@ -1,12 +1,26 @@
 import os
 import sqlite3
 import hashlib
+import hmac
 import secrets
-from datetime import datetime, date
+import ssl
+import time
+import csv
+import io
+import queue
+import atexit
+import functools
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, date, timedelta
 from pathlib import Path
 
-from flask import Flask, request, redirect, url_for, session, abort, send_from_directory
-from flask import render_template_string, flash
+from flask import Flask, request, redirect, url_for, session, abort, send_from_directory, g
+from flask import Response, stream_with_context
+from flask import flash, get_flashed_messages
+from markupsafe import Markup, escape
 
 # Optional webcam capture
 try:
@@ -15,54 +29,94 @@ try:
 except Exception:
     OPENCV_OK = False
 
+# Optional JIT for multi-day reports (pure Python fallback otherwise)
+try:
+    import numpy as np
+    from numba import njit, prange
+    NUMBA_OK = True
+except Exception:
+    NUMBA_OK = False
+
 APP_SECRET = os.environ.get("APP_SECRET", "change-this-in-production-please")
 DB_PATH = os.environ.get("DB_PATH", "attendance.db")
 SNAP_DIR = os.environ.get("SNAP_DIR", "snapshots")
+# PBKDF2 rounds for new hashes. 600k is the OWASP recommendation; lower it on
+# CPUs without SHA extensions if logins get too slow.
+PBKDF2_ITERS = int(os.environ.get("PBKDF2_ITERS", "600000"))
+KDF_CACHE_MAX = 512
+# Snapshots wider than this (px) are scaled down before saving; 0 keeps full size
+SNAP_DOWNSCALE = int(os.environ.get("SNAP_DOWNSCALE", "640"))
+SNAP_MAX_AGE = 31536000  # 1 year
 
 app = Flask(__name__)
 app.secret_key = APP_SECRET
 
 Path(SNAP_DIR).mkdir(parents=True, exist_ok=True)
 
+# hashlib's pbkdf2_hmac uses the linked OpenSSL, which picks SHA-NI / ARMv8
+# SHA2 instructions on its own when the CPU has them.
+SHA256_OK = "sha256" in hashlib.algorithms_guaranteed
+if not SHA256_OK:
+    app.logger.warning("hashlib has no guaranteed sha256 (%s); logins will fail", ssl.OPENSSL_VERSION)
+
 # ----------------------------
 # DB helpers
 # ----------------------------
-def db():
+def connect():
     con = sqlite3.connect(DB_PATH)
     con.row_factory = sqlite3.Row
+    # WAL: kiosk reads don't block on audit/attendance writes
+    con.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA foreign_keys=ON;
+    """)
+    return con
+
+def db():
+    # One connection per request, closed by close_db on teardown
+    con = getattr(g, "_db", None)
+    if con is None:
+        con = g._db = connect()
     return con
 
+@app.teardown_appcontext
+def close_db(exc):
+    con = g.pop("_db", None)
+    if con is not None:
+        con.close()
+
 def init_db():
-    with db() as con:
+    with closing(connect()) as con, con:
         cur = con.cursor()
-        cur.execute("""
+        cur.executescript("""
         CREATE TABLE IF NOT EXISTS admin (
             id INTEGER PRIMARY KEY,
             username TEXT UNIQUE NOT NULL,
-            pass_hash TEXT NOT NULL,
-            salt TEXT NOT NULL
-        )
-        """)
-        cur.execute("""
+            pass_hash BLOB NOT NULL,
+            salt BLOB NOT NULL,
+            algo TEXT NOT NULL DEFAULT 'legacy',
+            iters INTEGER NOT NULL DEFAULT 150000
+        );
         CREATE TABLE IF NOT EXISTS students (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             roll_no TEXT UNIQUE NOT NULL,
             full_name TEXT NOT NULL,
             class_name TEXT NOT NULL,
             section TEXT NOT NULL,
-            pin_hash TEXT NOT NULL,
-            salt TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-        cur.execute("""
+            pin_hash BLOB NOT NULL,
+            salt BLOB NOT NULL,
+            created_at TEXT NOT NULL,
+            algo TEXT NOT NULL DEFAULT 'legacy',
+            iters INTEGER NOT NULL DEFAULT 150000,
+            roll_order INTEGER
+        );
         CREATE TABLE IF NOT EXISTS day_session (
             day TEXT PRIMARY KEY,
             session_code TEXT NOT NULL,
             created_at TEXT NOT NULL
-        )
-        """)
-        cur.execute("""
+        );
         CREATE TABLE IF NOT EXISTS attendance (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             student_id INTEGER NOT NULL,
@@ -74,50 +128,149 @@ def init_db():
             user_agent TEXT,
             UNIQUE(student_id, day),
             FOREIGN KEY(student_id) REFERENCES students(id)
-        )
-        """)
-        cur.execute("""
+        );
         CREATE TABLE IF NOT EXISTS audit_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             ts TEXT NOT NULL,
             event TEXT NOT NULL,
             detail TEXT
-        )
+        );
         """)
 
+        # Older DBs: hashes predate the algo/iters columns and all used 150k rounds
+        add_column_if_missing(cur, "admin", "algo", "TEXT NOT NULL DEFAULT 'legacy'")
+        add_column_if_missing(cur, "students", "algo", "TEXT NOT NULL DEFAULT 'legacy'")
+        add_column_if_missing(cur, "admin", "iters", "INTEGER NOT NULL DEFAULT 150000")
+        add_column_if_missing(cur, "students", "iters", "INTEGER NOT NULL DEFAULT 150000")
+        # Numeric roll number, so reports sort 2 before 10 without CAST in ORDER BY
+        add_column_if_missing(cur, "students", "roll_order", "INTEGER")
+        cur.execute("UPDATE students SET roll_order=CAST(roll_no AS INTEGER) WHERE roll_order IS NULL")
+        # Hashes/salts used to be hex text; convert them to raw bytes once. The KDF
+        # took the salt's UTF-8 bytes, so the salt keeps those bytes, unchanged.
+        for table, col in (("admin", "pass_hash"), ("students", "pin_hash")):
+            old = cur.execute(f"SELECT id, {col} AS h, salt FROM {table} WHERE typeof({col})='text'").fetchall()
+            cur.executemany(f"UPDATE {table} SET {col}=?, salt=? WHERE id=?",
+                            [(bytes.fromhex(r["h"]), r["salt"].encode("utf-8"), r["id"]) for r in old])
+
+        # Dashboard: count + latest check-ins for a day. Reports: student sort order.
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_att_day ON attendance(day, checked_in_at DESC)")
+        cur.execute("DROP INDEX IF EXISTS idx_students_order")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_students_roll_order ON students(class_name, section, roll_order, roll_no)")
+
         # Create default admin if none exists
         cur.execute("SELECT COUNT(*) AS c FROM admin")
         if cur.fetchone()["c"] == 0:
             # Default: admin / admin123 (change immediately)
             username = "admin"
             password = "admin123"
-            salt = secrets.token_hex(16)
+            salt = secrets.token_bytes(16)
             pass_hash = hash_pw(password, salt)
-            cur.execute("INSERT INTO admin(username, pass_hash, salt) VALUES (?,?,?)",
-                        (username, pass_hash, salt))
+            cur.execute("INSERT INTO admin(username, pass_hash, salt, algo, iters) VALUES (?,?,?,?,?)",
+                        (username, pass_hash, salt, "pbkdf2", PBKDF2_ITERS))
             cur.execute("INSERT INTO audit_log(ts,event,detail) VALUES (?,?,?)",
                         (now(), "INIT_ADMIN", "Default admin created (admin/admin123). Change ASAP."))
+
+        # Give the query planner table stats for the indexes above
+        cur.execute("ANALYZE")
         con.commit()
 
+def add_column_if_missing(cur, table: str, column: str, decl: str):
+    cols = {r["name"] for r in cur.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
 def now():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Same output as strftime("%Y-%m-%d %H:%M:%S"), without the locale layer
+    return datetime.now().isoformat(sep=" ", timespec="seconds")
 
-def today():
-    return date.today().isoformat()
+# (day_start_ts, next_midnight_ts, iso): date.today() only changes at local
+# midnight. Swapped as one tuple so threads never see a half-updated entry.
+_TODAY_CACHE = (0.0, 0.0, "")
 
-def hash_pw(password: str, salt: str) -> str:
-    # PBKDF2-like simple approach: sha256(salt + password) iterated.
-    # For offline school PC, this is fine. If you want stronger: use passlib/bcrypt.
-    h = (salt + password).encode("utf-8")
+def today():
+    global _TODAY_CACHE
+    start, end, iso = _TODAY_CACHE
+    t = time.time()
+    if start <= t < end:
+        return iso
+    d = date.today()
+    start = datetime.combine(d, datetime.min.time()).timestamp()
+    end = datetime.combine(d + timedelta(days=1), datetime.min.time()).timestamp()
+    _TODAY_CACHE = (start, end, d.isoformat())
+    return _TODAY_CACHE[2]
+
+# pbkdf2_hmac releases the GIL, so a thread pool is enough to run several
+# verifications on separate cores during a class rush.
+KDF_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="kdf")
+# Bulk CSV imports get their own, smaller pool so kiosk/login checks never
+# queue behind hundreds of roster hashes, and some cores stay free for them.
+IMPORT_KDF_POOL = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2),
+                                     thread_name_prefix="kdf-import")
+
+def _pbkdf2(password: str, salt: bytes, iters: int) -> bytes:
+    # PBKDF2-HMAC-SHA256; the whole loop runs inside OpenSSL.
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iters)
+
+def hash_pw(password: str, salt: bytes, iters: int = PBKDF2_ITERS) -> bytes:
+    return KDF_POOL.submit(_pbkdf2, password, salt, iters).result()
+
+# Students often re-submit the same PIN (retries, double clicks), so keep a
+# small LRU of recent KDF results. Keys are an HMAC of the inputs, so no
+# plaintext PINs are kept in memory.
+_KDF_CACHE = OrderedDict()
+_KDF_LOCK = threading.Lock()
+
+def _kdf_key(password: str, salt: bytes, iters: int) -> bytes:
+    msg = iters.to_bytes(4, "big") + len(salt).to_bytes(2, "big") + salt + password.encode("utf-8")
+    return hmac.new(APP_SECRET.encode("utf-8"), msg, hashlib.sha256).digest()[:16]
+
+def hash_pw_cached(password: str, salt: bytes, iters: int = PBKDF2_ITERS) -> bytes:
+    key = _kdf_key(password, salt, iters)
+    with _KDF_LOCK:
+        hit = _KDF_CACHE.get(key)
+        if hit is not None:
+            _KDF_CACHE.move_to_end(key)
+            return hit
+    digest = hash_pw(password, salt, iters)
+    with _KDF_LOCK:
+        _KDF_CACHE[key] = digest
+        while len(_KDF_CACHE) > KDF_CACHE_MAX:
+            _KDF_CACHE.popitem(last=False)
+    return digest
+
+def clear_kdf_cache():
+    with _KDF_LOCK:
+        _KDF_CACHE.clear()
+
+atexit.register(clear_kdf_cache)
+
+def hash_pw_legacy(password: str, salt: bytes) -> bytes:
+    # Old scheme: sha256(salt + password) iterated in Python.
+    # Only used to verify rows that have not been re-hashed yet.
+    h = salt + password.encode("utf-8")
     for _ in range(150_000):
         h = hashlib.sha256(h).digest()
-    return h.hex()
+    return h
+
+def verify_pw(password: str, row, cached: bool = True) -> bool:
+    # row = admin/students row with salt, algo, iters and pass_hash/pin_hash
+    stored = row["pass_hash"] if "pass_hash" in row.keys() else row["pin_hash"]
+    if row["algo"] == "pbkdf2":
+        kdf = hash_pw_cached if cached else hash_pw
+        return hmac.compare_digest(kdf(password, row["salt"], row["iters"]), stored)
+    return hmac.compare_digest(hash_pw_legacy(password, row["salt"]), stored)
+
+def needs_rehash(row) -> bool:
+    return row["algo"] != "pbkdf2" or row["iters"] != PBKDF2_ITERS
 
 def log(event: str, detail: str = ""):
     with db() as con:
-        con.execute("INSERT INTO audit_log(ts,event,detail) VALUES (?,?,?)",
-                    (now(), event, detail[:1000]))
-        con.commit()
+        log_with(con, event, detail)
+
+def log_with(con, event: str, detail: str = ""):
+    # Audit insert on the caller's connection/transaction (caller commits)
+    con.execute("INSERT INTO audit_log(ts,event,detail) VALUES (?,?,?)",
+                (now(), event, detail[:1000]))
 
 # ----------------------------
 # Security / auth helpers
@@ -127,64 +280,195 @@ def require_admin():
         return redirect(url_for("admin_login"))
     return None
 
-def rate_limit_key():
-    # Simple per-session limiter
-    if "rl" not in session:
-        session["rl"] = {"count": 0, "ts": now()}
-    return session["rl"]
-
-def bump_rate_limit(max_attempts=20):
-    rl = rate_limit_key()
-    rl["count"] += 1
-    session["rl"] = rl
-    if rl["count"] > max_attempts:
+# Per-IP token bucket, kept in process memory: a burst of RL_BURST attempts,
+# refilled at RL_RATE per second. Clearing cookies doesn't reset it, and it
+# doesn't re-sign the session cookie on every POST. LRU-bounded to _RL_MAX IPs.
+RL_BURST = 20
+RL_RATE = 0.5
+_RL = OrderedDict()  # ip -> (tokens, last_ts)
+_RL_LOCK = threading.Lock()
+_RL_MAX = 1024
+
+def bump_rate_limit(burst=RL_BURST, rate=RL_RATE):
+    ip = request.remote_addr or "?"
+    t = time.monotonic()
+    with _RL_LOCK:
+        tokens, last = _RL.pop(ip, (burst, t))
+        tokens = min(burst, tokens + (t - last) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        _RL[ip] = (tokens, t)
+        while len(_RL) > _RL_MAX:
+            _RL.popitem(last=False)
+    if not allowed:
         abort(429)
 
 # ----------------------------
 # Session code (anti-cheat)
 # ----------------------------
+# The code only changes once a day, so keep it in memory and only go to
+# SQLite when the day rolls over.
+_SESSION_CACHE = {"day": None, "code": None}
+_SESSION_LOCK = threading.Lock()
+
 def get_or_create_session_code():
     d = today()
-    with db() as con:
-        cur = con.execute("SELECT session_code FROM day_session WHERE day=?", (d,))
-        row = cur.fetchone()
+    if _SESSION_CACHE["day"] == d:
+        return _SESSION_CACHE["code"]
+    with _SESSION_LOCK:
+        if _SESSION_CACHE["day"] != d:
+            _SESSION_CACHE["code"] = _load_session_code(d)
+            _SESSION_CACHE["day"] = d
+        return _SESSION_CACHE["code"]
+
+def _load_session_code(d: str) -> str:
+    con = db()
+    row = con.execute("SELECT session_code FROM day_session WHERE day=?", (d,)).fetchone()
+    if row:
+        return row["session_code"]
+    with con:
+        con.execute("BEGIN IMMEDIATE")
+        # Another process may have created it while we waited for the lock
+        row = con.execute("SELECT session_code FROM day_session WHERE day=?", (d,)).fetchone()
         if row:
             return row["session_code"]
         code = secrets.token_hex(3).upper()  # e.g. "A1B2C3"
         con.execute("INSERT INTO day_session(day, session_code, created_at) VALUES (?,?,?)",
                     (d, code, now()))
-        con.commit()
-        log("NEW_DAY_SESSION", f"day={d}, code={code}")
-        return code
+        log_with(con, "NEW_DAY_SESSION", f"day={d}, code={code}")
+    return code
 
 # ----------------------------
 # Webcam snapshot
 # ----------------------------
-def capture_snapshot(roll_no: str) -> str | None:
-    if not OPENCV_OK:
-        return None
-
+# A daemon thread owns the camera and keeps it open, so a check-in never waits
+# for warm-up. It only grab()s frames (no decode); when check-ins are pending
+# it retrieve()s (decodes) that one frame and hands it to SNAP_POOL, which
+# writes the JPEG and fills in attendance.snapshot_path.
+_CAMERA_LOCK = threading.Lock()
+_camera_started = False
+_camera_live = False
+_SNAP_REQUESTS = queue.SimpleQueue()  # (filename, attendance_id)
+SNAP_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snap")
+# Quality 80 is plenty to recognise a face and roughly halves the file size
+SNAP_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 80, cv2.IMWRITE_JPEG_OPTIMIZE, 1] if OPENCV_OK else []
+
+def _camera_loop():
+    global _camera_live
     # Capture from default webcam (0)
     cam = cv2.VideoCapture(0)
     if not cam.isOpened():
+        app.logger.warning("Webcam not available, snapshots disabled")
+        return
+    # 1-frame driver buffer so we never get a stale queued frame
+    cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    cam.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+    cam.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    try:
+        # Warm up frames
+        for _ in range(3):
+            cam.grab()
+        while True:
+            if not cam.grab():
+                _camera_live = False
+                time.sleep(0.5)
+                continue
+            _camera_live = True
+            if _SNAP_REQUESTS.empty():
+                continue
+            ok, frame = cam.retrieve()
+            while True:
+                try:
+                    filename, attendance_id = _SNAP_REQUESTS.get_nowait()
+                except queue.Empty:
+                    break
+                if ok and frame is not None:
+                    SNAP_POOL.submit(_save_snapshot, frame, filename, attendance_id)
+    finally:
+        _camera_live = False
+        cam.release()
+
+def start_camera():
+    global _camera_started
+    if not OPENCV_OK:
+        return
+    with _CAMERA_LOCK:
+        if _camera_started:
+            return
+        _camera_started = True
+    threading.Thread(target=_camera_loop, name="camera", daemon=True).start()
+
+def _save_snapshot(frame, filename: str, attendance_id: int):
+    try:
+        h, w = frame.shape[:2]
+        if SNAP_DOWNSCALE and w > SNAP_DOWNSCALE:
+            frame = cv2.resize(frame, (SNAP_DOWNSCALE, h * SNAP_DOWNSCALE // w), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", frame, SNAP_JPEG_PARAMS)
+        if not ok:
+            return
+        with open(os.path.join(SNAP_DIR, filename), "wb") as f:
+            f.write(buf.tobytes())
+        with closing(connect()) as con, con:
+            con.execute("UPDATE attendance SET snapshot_path=? WHERE id=?", (filename, attendance_id))
+            log_with(con, "SNAPSHOT_SAVED", f"attendance_id={attendance_id}, snap={filename}")
+    except Exception:
+        app.logger.exception("Saving snapshot %s failed", filename)
+
+def camera_ready() -> bool:
+    return OPENCV_OK and _camera_live
+
+def capture_snapshot(roll_no: str, attendance_id: int) -> str | None:
+    # Non-blocking: ask the camera thread for its next frame. Call only after
+    # the attendance row is committed. Returns the filename it will be saved
+    # under; SNAPSHOT_SAVED is logged once it is on disk.
+    if not camera_ready():
         return None
 
-    # Warm up frames
-    for _ in range(5):
-        cam.read()
-
-    ok, frame = cam.read()
-    cam.release()
-    if not ok or frame is None:
-        return None
-
-    # Save snapshot
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{today()}_{roll_no}_{ts}.jpg"
-    path = os.path.join(SNAP_DIR, filename)
-    cv2.imwrite(path, frame)
+    _SNAP_REQUESTS.put((filename, attendance_id))
     return filename
 
+# ----------------------------
+# Multi-day attendance tally
+# ----------------------------
+RANGE_MAX_DAYS = 366
+
+if NUMBA_OK:
+    @njit(parallel=True, cache=True)
+    def _tally(sids, days, n_students, n_days):
+        # out[student_id, day_offset] = 1 if checked in
+        out = np.zeros((n_students, n_days), np.uint8)
+        for i in prange(sids.size):
+            out[sids[i], days[i]] = 1
+        return out
+
+def tally_range(con, start: str, end: str):
+    # Returns (days_present indexable by student id, number of school days).
+    # A school day is any day in the range with at least one check-in.
+    cur = con.cursor()
+    cur.row_factory = None  # plain tuples for np.fromiter
+    cur.execute("""
+        SELECT student_id, CAST(julianday(day) - julianday(?) AS INTEGER)
+        FROM attendance
+        WHERE day BETWEEN ? AND ?
+    """, (start, start, end))
+
+    if NUMBA_OK:
+        n_students = con.execute("SELECT COALESCE(MAX(id), 0) + 1 AS n FROM students").fetchone()["n"]
+        n_days = (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+        recs = np.fromiter(cur, dtype=[("sid", np.int32), ("d", np.int16)])
+        out = _tally(recs["sid"], recs["d"], n_students, n_days)
+        return out.sum(axis=1), int(out.any(axis=0).sum())
+
+    counts = Counter()
+    school_days = set()
+    for sid, d in cur:
+        counts[sid] += 1
+        school_days.add(d)
+    return counts, len(school_days)
+
 # ----------------------------
 # Templates (kept inline for easy copy)
 # ----------------------------
@@ -218,31 +502,82 @@ BASE = """
       </div>
       <div>
         {% if admin %}
-          <a href="{{ url_for('admin_dashboard') }}">Admin</a> |
-          <a href="{{ url_for('admin_logout') }}">Logout</a>
+          <a href="{{ urls.admin_dashboard }}">Admin</a> |
+          <a href="{{ urls.admin_logout }}">Logout</a>
         {% else %}
-          <a href="{{ url_for('kiosk') }}">Kiosk</a> |
-          <a href="{{ url_for('admin_login') }}">Admin Login</a>
+          <a href="{{ urls.kiosk }}">Kiosk</a> |
+          <a href="{{ urls.admin_login }}">Admin Login</a>
         {% endif %}
       </div>
     </div>
   </div>
 
-  {% with messages = get_flashed_messages() %}
-    {% if messages %}
-      {% for m in messages %}
-        <div class="flash">{{ m }}</div>
-      {% endfor %}
-    {% endif %}
-  {% endwith %}
+  {% if messages %}
+    {% for m in messages %}
+      <div class="flash">{{ m }}</div>
+    {% endfor %}
+  {% endif %}
 
-  {{ body|safe }}
+  {{ body }}
 </body>
 </html>
 """
 
+# url_for() walks the URL map on every call; argument-free routes never change,
+# so resolve them once. Filled on first use since it needs a request context
+# (Flask 3 has no before_first_request).
+URL_ENDPOINTS = ("kiosk", "admin_login", "admin_logout", "admin_dashboard", "admin_reports",
+                 "admin_range_report", "admin_change_password", "admin_add_student",
+                 "admin_import_students")
+_URLS = {}
+
+def urls() -> dict:
+    if not _URLS:
+        _URLS.update({name: url_for(name) for name in URL_ENDPOINTS})
+    return _URLS
+
+@functools.lru_cache(maxsize=1024)
+def snapshot_url(filename: str) -> str:
+    return url_for("snapshot", filename=filename)
+
+# Parsed once; render_template_string would re-parse BASE on every call
+_BASE_TMPL = app.jinja_env.from_string(BASE)
+
 def page(title, body, subtitle="Offline classroom attendance", admin=False):
-    return render_template_string(BASE, title=title, body=body, subtitle=subtitle, admin=admin)
+    # body is HTML built by the route itself, hence Markup
+    return _BASE_TMPL.render(title=title, body=Markup(body), subtitle=subtitle, admin=admin,
+                             messages=get_flashed_messages(), urls=urls())
+
+# Hot pages (kiosk) skip Jinja: BASE is rendered once per layout with a
+# placeholder body and split around it; flashes + body are concatenated in
+# per request.
+BODY_SLOT = "\x00BODY\x00"
+
+@functools.lru_cache(maxsize=32)
+def page_shell(title, subtitle, admin) -> tuple[str, str]:
+    html = _BASE_TMPL.render(title=title, body=Markup(BODY_SLOT), subtitle=subtitle, admin=admin,
+                             messages=[], urls=urls())
+    prefix, suffix = html.split(BODY_SLOT)
+    return prefix, suffix
+
+def flash_html():
+    return "".join(f'<div class="flash">{escape(m)}</div>' for m in get_flashed_messages())
+
+def page_cached(title, body, subtitle="Offline classroom attendance", admin=False):
+    prefix, suffix = page_shell(title, subtitle, admin)
+    return Response(prefix + flash_html() + body + suffix, mimetype="text/html")
+
+def page_stream(title, chunks, subtitle="Offline classroom attendance", admin=False):
+    # Like page_cached, but body comes from an iterator of HTML chunks
+    prefix, suffix = page_shell(title, subtitle, admin)
+    flashes = flash_html()  # read now: the session is saved before streaming starts
+
+    def _gen():
+        yield prefix + flashes
+        yield from chunks
+        yield suffix
+
+    return Response(stream_with_context(_gen()), mimetype="text/html")
 
 # ----------------------------
 # Routes
@@ -254,6 +589,7 @@ def home():
 @app.route("/kiosk", methods=["GET", "POST"])
 def kiosk():
     # Student self-check on classroom PC
+    start_camera()
     code = get_or_create_session_code()
 
     if request.method == "POST":
@@ -273,55 +609,70 @@ def kiosk():
             flash("Wrong session code. Ask teacher for today’s code.")
             return redirect(url_for("kiosk"))
 
+        con = db()
+
         # Find student
-        with db() as con:
-            cur = con.execute("SELECT * FROM students WHERE roll_no=?", (roll_no,))
-            stu = cur.fetchone()
+        stu = con.execute("SELECT * FROM students WHERE roll_no=?", (roll_no,)).fetchone()
 
         if not stu:
-            log("CHECKIN_FAIL", f"roll={roll_no}, reason=unknown_roll")
+            with con:
+                log_with(con, "CHECKIN_FAIL", f"roll={roll_no}, reason=unknown_roll")
             flash("Unknown roll number.")
             return redirect(url_for("kiosk"))
 
         # Verify PIN
-        expected = hash_pw(pin, stu["salt"])
-        if expected != stu["pin_hash"]:
-            log("CHECKIN_FAIL", f"roll={roll_no}, reason=bad_pin")
+        if not verify_pw(pin, stu):
+            with con:
+                log_with(con, "CHECKIN_FAIL", f"roll={roll_no}, reason=bad_pin")
             flash("Wrong PIN.")
             return redirect(url_for("kiosk"))
 
-        # Capture snapshot (anti-cheat evidence)
-        snap_file = capture_snapshot(roll_no)
-
-        # Record attendance
-        try:
-            with db() as con:
-                con.execute("""
-                    INSERT INTO attendance(student_id, day, status, checked_in_at, snapshot_path, ip, user_agent)
-                    VALUES(?,?,?,?,?,?,?)
-                """, (
-                    stu["id"], today(), "P", now(),
-                    snap_file,
-                    request.remote_addr,
-                    request.headers.get("User-Agent", "")[:300]
-                ))
-                con.commit()
-            log("CHECKIN_OK", f"roll={roll_no}, snap={snap_file or 'none'}")
-            body = f"""
-            <div class="card">
-              <div class="ok">Checked in ✅</div>
-              <p><b>{stu['full_name']}</b> (Roll: <code>{stu['roll_no']}</code>)</p>
-              <p>Date: <code>{today()}</code> Time: <code>{now()}</code></p>
-              <p class="muted">If someone checked in for a friend, the teacher can verify using the snapshot + logs.</p>
-              <a href="{url_for('kiosk')}"><button>Next student</button></a>
-            </div>
-            """
-            return page("Kiosk: Attendance", body, subtitle="Student self-check-in", admin=False)
-        except sqlite3.IntegrityError:
-            log("CHECKIN_DUP", f"roll={roll_no} already checked today")
+        # Upgrade old hashes now that we know the PIN (hash before taking the write lock)
+        rehash = None
+        if needs_rehash(stu):
+            salt = secrets.token_bytes(16)
+            rehash = (hash_pw(pin, salt), salt, PBKDF2_ITERS, stu["id"])
+
+        # Record attendance; UNIQUE(student_id, day) turns a repeat into a no-op.
+        # snapshot_path is filled in by the snapshot worker after the commit.
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            if rehash:
+                con.execute("UPDATE students SET pin_hash=?, salt=?, algo='pbkdf2', iters=? WHERE id=?", rehash)
+            cur = con.execute("""
+                INSERT OR IGNORE INTO attendance(student_id, day, status, checked_in_at, snapshot_path, ip, user_agent)
+                VALUES(?,?,?,?,?,?,?)
+            """, (
+                stu["id"], today(), "P", now(),
+                None,
+                request.remote_addr,
+                request.headers.get("User-Agent", "")[:300]
+            ))
+            inserted = cur.rowcount == 1
+            if inserted:
+                attendance_id = cur.lastrowid
+                log_with(con, "CHECKIN_OK", f"roll={roll_no}, snap={'pending' if camera_ready() else 'none'}")
+            else:
+                log_with(con, "CHECKIN_DUP", f"roll={roll_no} already checked today")
+
+        if not inserted:
             flash("Already checked in today.")
             return redirect(url_for("kiosk"))
 
+        # Capture snapshot (anti-cheat evidence), only once the row is committed
+        capture_snapshot(roll_no, attendance_id)
+
+        body = f"""
+        <div class="card">
+          <div class="ok">Checked in ✅</div>
+          <p><b>{stu['full_name']}</b> (Roll: <code>{stu['roll_no']}</code>)</p>
+          <p>Date: <code>{today()}</code> Time: <code>{now()}</code></p>
+          <p class="muted">If someone checked in for a friend, the teacher can verify using the snapshot + logs.</p>
+          <a href="{urls()['kiosk']}"><button>Next student</button></a>
+        </div>
+        """
+        return page_cached("Kiosk: Attendance", body, subtitle="Student self-check-in", admin=False)
+
     # GET
     body = f"""
     <div class="card">
@@ -347,7 +698,7 @@ def kiosk():
       </p>
     </div>
     """
-    return page("Kiosk: Attendance", body, subtitle="Offline student self-check-in", admin=False)
+    return page_cached("Kiosk: Attendance", body, subtitle="Offline student self-check-in", admin=False)
 
 @app.route("/admin/login", methods=["GET", "POST"])
 def admin_login():
@@ -355,19 +706,26 @@ def admin_login():
         user = request.form.get("username", "").strip()
         pw = request.form.get("password", "").strip()
 
-        with db() as con:
-            row = con.execute("SELECT * FROM admin WHERE username=?", (user,)).fetchone()
+        con = db()
+        row = con.execute("SELECT * FROM admin WHERE username=?", (user,)).fetchone()
 
-        if not row:
+        if not row or not verify_pw(pw, row):
             flash("Invalid credentials.")
             return redirect(url_for("admin_login"))
 
-        if hash_pw(pw, row["salt"]) != row["pass_hash"]:
-            flash("Invalid credentials.")
-            return redirect(url_for("admin_login"))
+        # Upgrade old hashes now that we know the password
+        rehash = None
+        if needs_rehash(row):
+            salt = secrets.token_bytes(16)
+            rehash = (hash_pw(pw, salt), salt, PBKDF2_ITERS, row["id"])
+
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            if rehash:
+                con.execute("UPDATE admin SET pass_hash=?, salt=?, algo='pbkdf2', iters=? WHERE id=?", rehash)
+            log_with(con, "ADMIN_LOGIN", user)
 
         session["admin"] = True
-        log("ADMIN_LOGIN", user)
         return redirect(url_for("admin_dashboard"))
 
     body = """
@@ -387,6 +745,7 @@ def admin_login():
 @app.route("/admin/logout")
 def admin_logout():
     session.clear()
+    clear_kdf_cache()
     return redirect(url_for("admin_login"))
 
 @app.route("/admin", methods=["GET"])
@@ -396,26 +755,27 @@ def admin_dashboard():
 
     code = get_or_create_session_code()
 
-    with db() as con:
-        total_students = con.execute("SELECT COUNT(*) AS c FROM students").fetchone()["c"]
-        today_present = con.execute("""
-            SELECT COUNT(*) AS c
-            FROM attendance a
-            WHERE a.day=?
-        """, (today(),)).fetchone()["c"]
-
-        recent = con.execute("""
-            SELECT a.checked_in_at, s.roll_no, s.full_name, a.snapshot_path
-            FROM attendance a
-            JOIN students s ON s.id=a.student_id
-            WHERE a.day=?
-            ORDER BY a.checked_in_at DESC
-            LIMIT 50
-        """, (today(),)).fetchall()
-
+    con = db()
+    total_students = con.execute("SELECT COUNT(*) AS c FROM students").fetchone()["c"]
+    today_present = con.execute("""
+        SELECT COUNT(*) AS c
+        FROM attendance a
+        WHERE a.day=?
+    """, (today(),)).fetchone()["c"]
+
+    recent = con.execute("""
+        SELECT a.checked_in_at, s.roll_no, s.full_name, a.snapshot_path
+        FROM attendance a
+        JOIN students s ON s.id=a.student_id
+        WHERE a.day=?
+        ORDER BY a.checked_in_at DESC
+        LIMIT 50
+    """, (today(),)).fetchall()
+
+    u = urls()
     rows = ""
     for x in recent:
-        snap_link = f"<a href='{url_for('snapshot', filename=x['snapshot_path'])}'>view</a>" if x["snapshot_path"] else "—"
+        snap_link = f"<a href='{snapshot_url(x['snapshot_path'])}'>view</a>" if x["snapshot_path"] else "—"
         rows += f"<tr><td>{x['checked_in_at']}</td><td>{x['roll_no']}</td><td>{x['full_name']}</td><td>{snap_link}</td></tr>"
 
     body = f"""
@@ -436,7 +796,7 @@ def admin_dashboard():
 
     <div class="card">
       <h3>Add student</h3>
-      <form method="POST" action="{url_for('admin_add_student')}">
+      <form method="POST" action="{u['admin_add_student']}">
         <div class="row">
           <div>
             <label>Roll No</label>
@@ -463,6 +823,15 @@ def admin_dashboard():
       </form>
     </div>
 
+    <div class="card">
+      <h3>Import students (CSV)</h3>
+      <form method="POST" action="{u['admin_import_students']}" enctype="multipart/form-data">
+        <input name="csv" type="file" accept=".csv,text/csv" required>
+        <button type="submit">Import</button>
+      </form>
+      <p class="muted">One student per line: <code>roll_no,full_name,class_name,section,pin</code>. Header row optional.</p>
+    </div>
+
     <div class="card">
       <h3>Today check-ins (latest 50)</h3>
       <table border="0" cellpadding="6" cellspacing="0" style="width:100%;">
@@ -473,12 +842,18 @@ def admin_dashboard():
     </div>
 
     <div class="card">
-      <a href="{url_for('admin_reports')}"><button>Reports</button></a>
-      <a href="{url_for('admin_change_password')}"><button style="margin-left:8px;">Change admin password</button></a>
+      <a href="{u['admin_reports']}"><button>Reports</button></a>
+      <a href="{u['admin_range_report']}"><button style="margin-left:8px;">Range report</button></a>
+      <a href="{u['admin_change_password']}"><button style="margin-left:8px;">Change admin password</button></a>
     </div>
     """
     return page("Admin Dashboard", body, subtitle="Offline classroom attendance", admin=True)
 
+INSERT_STUDENT_SQL = """
+    INSERT INTO students(roll_no, full_name, class_name, section, pin_hash, salt, created_at, algo, iters, roll_order)
+    VALUES(?,?,?,?,?,?,?,?,?,CAST(? AS INTEGER))
+"""
+
 @app.route("/admin/add_student", methods=["POST"])
 def admin_add_student():
     r = require_admin()
@@ -494,23 +869,72 @@ def admin_add_student():
         flash("All fields required.")
         return redirect(url_for("admin_dashboard"))
 
-    salt = secrets.token_hex(16)
+    salt = secrets.token_bytes(16)
     pin_hash = hash_pw(pin, salt)
 
     try:
         with db() as con:
-            con.execute("""
-                INSERT INTO students(roll_no, full_name, class_name, section, pin_hash, salt, created_at)
-                VALUES(?,?,?,?,?,?,?)
-            """, (roll, name, cls, sec, pin_hash, salt, now()))
-            con.commit()
-        log("ADD_STUDENT", f"roll={roll}, name={name}, class={cls}-{sec}")
+            con.execute("BEGIN IMMEDIATE")
+            con.execute(INSERT_STUDENT_SQL, (roll, name, cls, sec, pin_hash, salt, now(), "pbkdf2", PBKDF2_ITERS, roll))
+            log_with(con, "ADD_STUDENT", f"roll={roll}, name={name}, class={cls}-{sec}")
         flash("Student added.")
     except sqlite3.IntegrityError:
         flash("Roll number already exists.")
 
     return redirect(url_for("admin_dashboard"))
 
+@app.route("/admin/import_students", methods=["POST"])
+def admin_import_students():
+    r = require_admin()
+    if r: return r
+
+    f = request.files.get("csv")
+    if not f or not f.filename:
+        flash("Choose a CSV file.")
+        return redirect(url_for("admin_dashboard"))
+
+    # Columns: roll_no, full_name, class_name, section, pin (header row optional)
+    text = f.read().decode("utf-8-sig", errors="replace")
+    parsed = []
+    first = True
+    reader = csv.reader(io.StringIO(text))
+    for rec in reader:
+        rec = [c.strip() for c in rec]
+        if not any(rec):
+            continue
+        # Header = first non-empty record, however many blank lines precede it
+        is_header = first and rec[0].lower() == "roll_no"
+        first = False
+        if is_header:
+            continue
+        if len(rec) != 5 or not all(rec):
+            # line_num counts physical lines, so quoted newlines don't skew it
+            flash(f"Line {reader.line_num}: expected roll_no, full_name, class_name, section, pin. Nothing imported.")
+            return redirect(url_for("admin_dashboard"))
+        parsed.append(rec)
+
+    if not parsed:
+        flash("CSV has no students.")
+        return redirect(url_for("admin_dashboard"))
+
+    # Hash everything (in parallel) before taking the write lock; fresh salts, so no KDF cache
+    ts = now()
+    salts = [secrets.token_bytes(16) for _ in parsed]
+    hashes = IMPORT_KDF_POOL.map(_pbkdf2, [rec[4] for rec in parsed], salts, [PBKDF2_ITERS] * len(parsed))
+    rows = [(roll, name, cls, sec, ph, salt, ts, "pbkdf2", PBKDF2_ITERS, roll)
+            for (roll, name, cls, sec, _pin), salt, ph in zip(parsed, salts, hashes)]
+
+    try:
+        with db() as con:
+            con.execute("BEGIN IMMEDIATE")
+            con.executemany(INSERT_STUDENT_SQL, rows)
+            log_with(con, "IMPORT_STUDENTS", f"count={len(rows)}, file={f.filename}")
+        flash(f"Imported {len(rows)} students.")
+    except sqlite3.IntegrityError:
+        flash("Import failed: a roll number already exists (or repeats in the file). Nothing imported.")
+
+    return redirect(url_for("admin_dashboard"))
+
 @app.route("/admin/reports")
 def admin_reports():
     r = require_admin()
@@ -518,30 +942,18 @@ def admin_reports():
 
     day = request.args.get("day", today()).strip()
 
-    with db() as con:
-        # All students + present marker
-        rows = con.execute("""
-            SELECT s.roll_no, s.full_name, s.class_name, s.section,
-                   CASE WHEN a.id IS NULL THEN 'A' ELSE 'P' END AS status,
-                   a.checked_in_at, a.snapshot_path
-            FROM students s
-            LEFT JOIN attendance a
-              ON a.student_id=s.id AND a.day=?
-            ORDER BY s.class_name, s.section, CAST(s.roll_no AS INT), s.roll_no
-        """, (day,)).fetchall()
-
-    tr = ""
-    present = 0
-    absent = 0
-    for x in rows:
-        if x["status"] == "P":
-            present += 1
-        else:
-            absent += 1
-        snap_link = f"<a href='{url_for('snapshot', filename=x['snapshot_path'])}'>view</a>" if x["snapshot_path"] else "—"
-        tr += f"<tr><td>{x['class_name']}</td><td>{x['section']}</td><td>{x['roll_no']}</td><td>{x['full_name']}</td><td>{x['status']}</td><td>{x['checked_in_at'] or '—'}</td><td>{snap_link}</td></tr>"
-
-    body = f"""
+    con = db()
+    # That day's check-ins (idx_att_day); students are streamed in report order below
+    att_by_id = {a["student_id"]: a for a in con.execute("""
+        SELECT student_id, checked_in_at, snapshot_path
+        FROM attendance
+        WHERE day=?
+    """, (day,))}
+    total = con.execute("SELECT COUNT(*) AS c FROM students").fetchone()["c"]
+    present = len(att_by_id)
+    absent = total - present
+
+    head = f"""
     <div class="card">
       <form method="GET">
         <label>Report date (YYYY-MM-DD)</label>
@@ -558,11 +970,100 @@ def admin_reports():
           <th align="left">Class</th><th align="left">Sec</th><th align="left">Roll</th><th align="left">Name</th>
           <th align="left">Status</th><th align="left">Time</th><th align="left">Snapshot</th>
         </tr>
-        {tr if tr else "<tr><td colspan='7' class='muted'>No students in DB</td></tr>"}
+    """
+    tail = """
       </table>
     </div>
     """
-    return page("Reports", body, subtitle="Daily attendance report", admin=True)
+
+    def rows():
+        yield head
+        if not total:
+            yield "<tr><td colspan='7' class='muted'>No students in DB</td></tr>"
+        # All students (idx_students_roll_order), a batch at a time
+        cur = con.execute("""
+            SELECT id, roll_no, full_name, class_name, section
+            FROM students
+            ORDER BY class_name, section, roll_order, roll_no
+        """)
+        while batch := cur.fetchmany(256):
+            parts = []
+            for x in batch:
+                a = att_by_id.get(x["id"])
+                snap_link = f"<a href='{snapshot_url(a['snapshot_path'])}'>view</a>" if a and a["snapshot_path"] else "—"
+                parts.append(f"<tr><td>{x['class_name']}</td><td>{x['section']}</td><td>{x['roll_no']}</td><td>{x['full_name']}</td><td>{'P' if a else 'A'}</td><td>{a['checked_in_at'] if a else '—'}</td><td>{snap_link}</td></tr>")
+            yield "".join(parts)
+        yield tail
+
+    return page_stream("Reports", rows(), subtitle="Daily attendance report", admin=True)
+
+@app.route("/admin/range_report")
+def admin_range_report():
+    r = require_admin()
+    if r: return r
+
+    t = date.fromisoformat(today())
+    start = request.args.get("start", t.replace(day=1).isoformat()).strip()
+    end = request.args.get("end", t.isoformat()).strip()
+    try:
+        # Normalise: fromisoformat also takes 20261014 / 2026-W42-1, but SQL
+        # compares the stored YYYY-MM-DD text
+        start_d, end_d = date.fromisoformat(start), date.fromisoformat(end)
+        start, end = start_d.isoformat(), end_d.isoformat()
+        span = (end_d - start_d).days + 1
+    except ValueError:
+        flash("Dates must be YYYY-MM-DD.")
+        return redirect(url_for("admin_range_report"))
+    if not 1 <= span <= RANGE_MAX_DAYS:
+        flash(f"End must be on or after start, and at most {RANGE_MAX_DAYS} days later.")
+        return redirect(url_for("admin_range_report"))
+
+    con = db()
+    days_present, school_days = tally_range(con, start, end)
+    students = con.execute("""
+        SELECT id, roll_no, full_name, class_name, section
+        FROM students
+        ORDER BY class_name, section, roll_order, roll_no
+    """).fetchall()
+
+    parts = []
+    for x in students:
+        n = int(days_present[x["id"]])
+        pct = f"{100 * n / school_days:.0f}%" if school_days else "—"
+        parts.append(f"<tr><td>{x['class_name']}</td><td>{x['section']}</td><td>{x['roll_no']}</td><td>{x['full_name']}</td><td>{n}</td><td>{pct}</td></tr>")
+    tr = "".join(parts)
+
+    body = f"""
+    <div class="card">
+      <form method="GET">
+        <div class="row">
+          <div>
+            <label>From (YYYY-MM-DD)</label>
+            <input name="start" value="{escape(start)}">
+          </div>
+          <div>
+            <label>To (YYYY-MM-DD)</label>
+            <input name="end" value="{escape(end)}">
+          </div>
+        </div>
+        <button type="submit">Load</button>
+      </form>
+      <p><b>School days:</b> <code>{school_days}</code></p>
+      <p class="muted">A school day is a day in the range with at least one check-in.
+        Tally: {'Numba' if NUMBA_OK else 'pure Python (install numba for large ranges)'}.</p>
+    </div>
+
+    <div class="card">
+      <table border="0" cellpadding="6" cellspacing="0" style="width:100%;">
+        <tr>
+          <th align="left">Class</th><th align="left">Sec</th><th align="left">Roll</th><th align="left">Name</th>
+          <th align="left">Days present</th><th align="left">Attendance</th>
+        </tr>
+        {tr if tr else "<tr><td colspan='6' class='muted'>No students in DB</td></tr>"}
+      </table>
+    </div>
+    """
+    return page("Range Report", body, subtitle="Attendance over a date range", admin=True)
 
 @app.route("/admin/change_password", methods=["GET", "POST"])
 def admin_change_password():
@@ -577,19 +1078,21 @@ def admin_change_password():
             flash("New passwords do not match.")
             return redirect(url_for("admin_change_password"))
 
-        with db() as con:
-            row = con.execute("SELECT * FROM admin WHERE username='admin'").fetchone()
+        con = db()
+        row = con.execute("SELECT * FROM admin WHERE username='admin'").fetchone()
 
-        if not row or hash_pw(old, row["salt"]) != row["pass_hash"]:
+        # Uncached: never let a password change go through a cached digest
+        if not row or not verify_pw(old, row, cached=False):
             flash("Old password wrong.")
             return redirect(url_for("admin_change_password"))
 
-        salt = secrets.token_hex(16)
+        salt = secrets.token_bytes(16)
         ph = hash_pw(new, salt)
-        with db() as con:
-            con.execute("UPDATE admin SET pass_hash=?, salt=? WHERE username='admin'", (ph, salt))
-            con.commit()
-        log("ADMIN_PW_CHANGE", "admin password changed")
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            con.execute("UPDATE admin SET pass_hash=?, salt=?, algo='pbkdf2', iters=? WHERE username='admin'",
+                        (ph, salt, PBKDF2_ITERS))
+            log_with(con, "ADMIN_PW_CHANGE", "admin password changed")
         flash("Password updated.")
         return redirect(url_for("admin_dashboard"))
 
@@ -612,16 +1115,26 @@ def admin_change_password():
 def snapshot(filename):
     r = require_admin()
     if r: return r
-    # Serve snapshots only to admin
-    return send_from_directory(SNAP_DIR, filename)
+    # Serve snapshots only to admin. Files never change once written (name has
+    # day+roll+time), so let the browser keep them and revalidate via ETag.
+    resp = send_from_directory(SNAP_DIR, filename, conditional=True, etag=True, max_age=SNAP_MAX_AGE)
+    resp.headers["Cache-Control"] = f"private, immutable, max-age={SNAP_MAX_AGE}"
+    return resp
 
 # ----------------------------
 # Run
 # ----------------------------
 if __name__ == "__main__":
     init_db()
+    print(f"KDF: pbkdf2_hmac sha256, {PBKDF2_ITERS} rounds, {ssl.OPENSSL_VERSION}")
     # Host 0.0.0.0 only if you want LAN access. For single PC: 127.0.0.1 is enough.
-    app.run(host="127.0.0.1", port=5000, debug=True)
+    # Needs a threaded server for KDF_POOL to help; prefer waitress if installed.
+    try:
+        from waitress import serve
+    except ImportError:
+        app.run(host="127.0.0.1", port=5000, debug=True, threaded=True)
+    else:
+        serve(app, host="127.0.0.1", port=5000, threads=max(8, os.cpu_count() or 2))
 
 
 # This is the rest of the file.